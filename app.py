@@ -1,8 +1,13 @@
 # app.py
+import hashlib
+import hmac
+import io
 import os
+import tempfile
 import numpy as np
 import pandas as pd
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import altair as alt
@@ -13,21 +18,30 @@ load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-# Importar supabase solo si hay credenciales (para evitar error en entornos demo)
-SUPABASE_AVAILABLE = False
-try:
-    if SUPABASE_URL and SUPABASE_KEY:
+# Caché en disco de los datos demo: directorio propio de la app (no el /tmp compartido)
+DEMO_CACHE_DIR = os.getenv(
+    "DEMO_CACHE_DIR",
+    os.path.join(os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "uep_asistencia"),
+)
+DEMO_SCHEMA_VERSION = 3  # subir al cambiar columnas/dtypes de los datos demo (invalida el parquet)
+
+@st.cache_resource(show_spinner=False)
+def get_supabase():
+    """Cliente de Supabase compartido entre sesiones; None si no hay credenciales."""
+    # Importar supabase solo si hay credenciales (para evitar error en entornos demo)
+    if not (SUPABASE_URL and SUPABASE_KEY):
+        return None
+    try:
         from supabase import create_client
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-        SUPABASE_AVAILABLE = True
-except Exception:
-    SUPABASE_AVAILABLE = False
+        return create_client(SUPABASE_URL, SUPABASE_KEY)
+    except Exception:
+        return None
 
 # ============ LOGIN BÁSICO ============ #
+# Se guarda el SHA-256 de cada contraseña, calculado una vez al cargar el módulo
 USERS = {
-    "admin": "admin",
-    "organizador": "organizador",
+    user: hashlib.sha256(password.encode()).digest()
+    for user, password in (("admin", "admin"), ("organizador", "organizador"))
 }
 
 if "logged_in" not in st.session_state:
@@ -50,7 +64,11 @@ def combine_date_time(date_series: pd.Series, time_series: pd.Series, local_tz:
     Combina fecha (date/str) y hora (str/Time) a Timestamp aware en UTC.
     Asume que la hora declarada es local (America/Lima) y la convierte a UTC.
     """
-    dt_naive = pd.to_datetime(date_series.astype(str) + " " + time_series.astype(str), errors="coerce")
+    # fecha + duración desde medianoche: aritmética datetime64 sin parsear "fecha hora" por fila
+    dt_naive = (
+        pd.to_datetime(date_series, errors="coerce")
+        + pd.to_timedelta(time_series.astype(str), errors="coerce")
+    )
     # Localiza en zona horaria local y convierte a UTC
     dt_local = dt_naive.dt.tz_localize(local_tz, nonexistent="shift_forward", ambiguous="NaT")
     return dt_local.dt.tz_convert("UTC")
@@ -60,21 +78,144 @@ def combine_date_time(date_series: pd.Series, time_series: pd.Series, local_tz:
 # - usuarios(id uuid, nombre_completo text, correo_institucional text, rol text, facultad text, activo bool, creado_en timestamptz)
 # - eventos(id uuid, titulo text, tipo text, facultad text, fecha date, hora_inicio time, hora_fin time, organizador_id uuid, ubicacion text, cupos int, created_at timestamptz)
 # - asistencias(id bigint, evento_id uuid, usuario_id uuid, hora_checkin timestamptz, metodo enum/text, estado enum/text, valido bool, created_at timestamptz, origen text)
+# Función opcional (sql/resumen_asistencia.sql):
+# - resumen_asistencia(p_facultades text[], p_tipos text[], p_desde date, p_hasta date) returns json
+
+# Columnas que usa el dashboard (evita transferir columnas que no se muestran).
+# eventos va completa: la tabla "Detalle de eventos filtrados" y su descarga muestran todas.
+SUPABASE_COLUMNS = {
+    "usuarios": "id,nombre_completo,rol,facultad",
+    "eventos": "id,titulo,tipo,facultad,fecha,hora_inicio,hora_fin,organizador_id,ubicacion,cupos,created_at",
+    "asistencias": "id,evento_id,usuario_id,hora_checkin,metodo,estado,valido",
+}
+
+# Columnas de texto de baja cardinalidad que se guardan como category
+CATEGORY_COLUMNS = ["facultad", "tipo", "rol", "metodo", "estado", "origen", "facultad_evento", "estado_ingreso"]
+
+def _share_categories(left: pd.DataFrame, lcol: str, right: pd.DataFrame, rcol: str) -> None:
+    """Convierte dos llaves de merge a category con las mismas categorías (in place)."""
+    if lcol not in left.columns or rcol not in right.columns:
+        return
+    cats = pd.api.types.union_categoricals(
+        [left[lcol].astype("category"), right[rcol].astype("category")], ignore_order=True
+    ).categories
+    left[lcol] = pd.Categorical(left[lcol], categories=cats)
+    right[rcol] = pd.Categorical(right[rcol], categories=cats)
+
+def enrich_attendance(df_events, df_att):
+    """
+    Agrega a las asistencias, una sola vez al cargar: facultad del evento
+    (facultad_evento), minutos desde el inicio (lat_min) y estado de ingreso
+    (Presente ≤ 15 min, si no Tarde). Las vistas ya no cruzan con eventos para esto.
+    """
+    if df_att.empty or df_events.empty or "evento_id" not in df_att.columns:
+        return df_att
+    ev = df_events.set_index("id")
+    inicio_dt = combine_date_time(ev["fecha"], ev["hora_inicio"], local_tz="America/Lima")
+    df_att["facultad_evento"] = df_att["evento_id"].map(ev["facultad"])
+    df_att["lat_min"] = (df_att["hora_checkin"] - df_att["evento_id"].map(inicio_dt)).dt.total_seconds() / 60
+    df_att["estado_ingreso"] = pd.Series(
+        np.where(df_att["lat_min"] <= 15, "Presente", "Tarde"), index=df_att.index
+    ).where(df_att["lat_min"].notna())
+    return df_att
+
+def to_category_dtypes(df_users, df_events, df_att):
+    """
+    Pasa a category las columnas repetitivas y las llaves de merge, para que merges y
+    groupbys operen sobre códigos enteros en lugar de hashear strings.
+    """
+    for df in (df_users, df_events, df_att):
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype("category")
+    _share_categories(df_events, "id", df_att, "evento_id")
+    _share_categories(df_users, "id", df_att, "usuario_id")
+    return df_users, df_events, df_att
+
+@st.cache_data(show_spinner=False, ttl=60)
+def supabase_has_data():
+    """
+    True si Supabase responde y usuarios, eventos y asistencias tienen filas (sin filtros).
+    Es la única decisión de modo demo: filtros, datos y agregados usan la misma fuente.
+    """
+    supabase = get_supabase()
+    if supabase is None:
+        return False
+    try:
+        return all(
+            supabase.table(table).select("id").limit(1).execute().data
+            for table in ("usuarios", "eventos", "asistencias")
+        )
+    except Exception:
+        return False
+
+def _filter_events(query, fac_sel=None, tipo_sel=None, d1=None, d2=None, prefix=""):
+    """Agrega a una consulta PostgREST los filtros de eventos (prefix="eventos." para un embed)."""
+    if fac_sel is not None:
+        query = query.in_(f"{prefix}facultad", list(fac_sel))
+    if tipo_sel is not None:
+        query = query.in_(f"{prefix}tipo", list(tipo_sel))
+    if d1 is not None:
+        query = query.gte(f"{prefix}fecha", d1.isoformat())
+    if d2 is not None:
+        query = query.lte(f"{prefix}fecha", d2.isoformat())
+    return query
 
 @st.cache_data(show_spinner=False, ttl=60)
-def fetch_from_supabase():
-    """Lee usuarios, eventos y asistencias desde Supabase y retorna dataframes."""
-    if not SUPABASE_AVAILABLE:
+def fetch_event_options_from_supabase():
+    """Lee solo facultad, tipo y fecha de los eventos para poblar los filtros."""
+    supabase = get_supabase()
+    if supabase is None:
+        return None
+
+    try:
+        res = supabase.table("eventos").select("facultad,tipo,fecha").execute()
+        df_opts = pd.DataFrame(res.data) if res.data else pd.DataFrame()
+        if not df_opts.empty:
+            df_opts["fecha"] = pd.to_datetime(df_opts["fecha"], errors="coerce")
+        return df_opts
+    except Exception as e:
+        st.warning(f"No se pudo leer de Supabase: {e}")
+        return None
+
+@st.cache_data(show_spinner=False, ttl=60)
+def fetch_from_supabase(fac_sel=None, tipo_sel=None, d1=None, d2=None, with_att=True):
+    """
+    Lee usuarios, eventos y asistencias desde Supabase y retorna dataframes.
+    Los filtros (facultad, tipo, rango de fechas) se resuelven en PostgREST: solo
+    viajan los eventos filtrados y las asistencias de esos eventos (embed eventos!inner,
+    sin listar ids en la URL). La caché queda indexada por la combinación de filtros.
+    Con with_att=False no se leen asistencias.
+    """
+    supabase = get_supabase()
+    if supabase is None:
         return None, None, None
 
+    filtered = any(v is not None for v in (fac_sel, tipo_sel, d1, d2))
     try:
-        res_users = supabase.table("usuarios").select("*").execute()
-        res_events = supabase.table("eventos").select("*").execute()
-        res_att = supabase.table("asistencias").select("*").execute()
+        q_events = _filter_events(
+            supabase.table("eventos").select(SUPABASE_COLUMNS["eventos"]), fac_sel, tipo_sel, d1, d2
+        )
+        if filtered:
+            # semi-join en el servidor: asistencias cuyo evento cumple los mismos filtros
+            q_att = _filter_events(
+                supabase.table("asistencias").select(SUPABASE_COLUMNS["asistencias"] + ",eventos!inner(id)"),
+                fac_sel, tipo_sel, d1, d2, prefix="eventos.",
+            )
+        else:
+            q_att = supabase.table("asistencias").select(SUPABASE_COLUMNS["asistencias"])
+
+        # Las tres consultas son independientes y se lanzan en paralelo
+        with ThreadPoolExecutor(max_workers=3) as ex:
+            f_users = ex.submit(supabase.table("usuarios").select(SUPABASE_COLUMNS["usuarios"]).execute)
+            f_events = ex.submit(q_events.execute)
+            f_att = ex.submit(q_att.execute) if with_att else None
+            res_users, res_events = f_users.result(), f_events.result()
+            att_data = f_att.result().data if f_att is not None else []
 
         df_users = pd.DataFrame(res_users.data) if res_users.data else pd.DataFrame()
         df_events = pd.DataFrame(res_events.data) if res_events.data else pd.DataFrame()
-        df_att = pd.DataFrame(res_att.data) if res_att.data else pd.DataFrame()
+        df_att = pd.DataFrame(att_data).drop(columns="eventos", errors="ignore") if att_data else pd.DataFrame()
 
         # Normalizaciones básicas
         if not df_att.empty and "hora_checkin" in df_att.columns:
@@ -82,96 +223,282 @@ def fetch_from_supabase():
             df_att["hora_checkin"] = pd.to_datetime(df_att["hora_checkin"], errors="coerce", utc=True)
 
         if not df_events.empty and "fecha" in df_events.columns:
-            df_events["fecha"] = pd.to_datetime(df_events["fecha"], errors="coerce").dt.date
+            # datetime64: los filtros por fecha comparan int64 en NumPy, no objetos date
+            df_events["fecha"] = pd.to_datetime(df_events["fecha"], errors="coerce")
             df_events = normalize_event_times(df_events)
 
-        return df_users, df_events, df_att
+        df_att = enrich_attendance(df_events, df_att)
+        return to_category_dtypes(df_users, df_events, df_att)
     except Exception as e:
         st.warning(f"No se pudo leer de Supabase: {e}")
         return None, None, None
 
+@st.cache_data(show_spinner=False, ttl=60)
+def fetch_att_summary_from_supabase(fac_sel=None, tipo_sel=None, d1=None, d2=None):
+    """
+    Agregados de asistencia calculados en Postgres por la función resumen_asistencia.
+    Retorna None si no hay conexión o la función no está desplegada (se agrega en pandas).
+    """
+    supabase = get_supabase()
+    if supabase is None or not supabase_has_data():
+        return None
+
+    try:
+        res = supabase.rpc("resumen_asistencia", {
+            "p_facultades": list(fac_sel) if fac_sel is not None else None,
+            "p_tipos": list(tipo_sel) if tipo_sel is not None else None,
+            "p_desde": d1.isoformat() if d1 is not None else None,
+            "p_hasta": d2.isoformat() if d2 is not None else None,
+        }).execute()
+    except Exception:
+        return None
+
+    data = res.data or {}
+    tendencia = pd.DataFrame(data.get("tendencia") or [], columns=["fecha", "asistentes"])
+    tendencia["fecha"] = pd.to_datetime(tendencia["fecha"]).dt.date
+    return {
+        "asistentes_unicos": int(data.get("asistentes_unicos") or 0),
+        "tendencia": tendencia,
+        "por_evento": pd.DataFrame(data.get("por_evento") or [], columns=["evento_id", "presentes"]),
+        "por_facultad_estado": pd.DataFrame(data.get("por_facultad_estado") or [], columns=["facultad", "estado", "n"]),
+        "heatmap": pd.DataFrame(data.get("heatmap") or [], columns=["facultad", "hora", "n"]),
+    }
+
+def _write_parquet_atomic(df, path):
+    """Escribe a un temporal en el mismo directorio y lo mueve con os.replace: nunca se lee a medias."""
+    fd, tmp_path = tempfile.mkstemp(prefix=".demo_", suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            df.to_parquet(f, index=False)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+def _prune_demo_cache(keep_prefix):
+    """Borra los parquet demo de días o versiones anteriores."""
+    for name in os.listdir(DEMO_CACHE_DIR):
+        if name.startswith("demo_v") and name.endswith(".parquet") and not name.startswith(keep_prefix):
+            try:
+                os.remove(os.path.join(DEMO_CACHE_DIR, name))
+            except OSError:
+                pass
+
 @st.cache_data(show_spinner=False)
 def generate_demo_data(seed=42):
+    """
+    Datos demo con caché en disco (parquet) por semilla y día: un arranque en frío lee
+    los archivos en lugar de regenerarlos. Las fechas demo son relativas a hoy.
+    """
+    day_prefix = f"demo_v{DEMO_SCHEMA_VERSION}_{datetime.now():%Y%m%d}_"
+    paths = [
+        os.path.join(DEMO_CACHE_DIR, f"{day_prefix}{seed}_{name}.parquet")
+        for name in ("usuarios", "eventos", "asistencias")
+    ]
+    if all(os.path.exists(path) for path in paths):
+        try:
+            return tuple(pd.read_parquet(path) for path in paths)
+        except Exception:
+            pass  # archivo corrupto: se regenera
+
+    frames = build_demo_data(seed)
+    try:
+        # 0o700: otro usuario local no puede dejar archivos que se carguen como datos
+        os.makedirs(DEMO_CACHE_DIR, mode=0o700, exist_ok=True)
+        for df, path in zip(frames, paths):
+            _write_parquet_atomic(df, path)
+        _prune_demo_cache(day_prefix)
+    except Exception:
+        pass  # sin permisos de escritura: queda solo la caché en memoria
+    return frames
+
+def build_demo_data(seed=42):
     """Genera datos simulados con el mismo esquema para ver el dashboard sin Supabase."""
-    np.random.seed(seed)
+    rng = np.random.default_rng(seed)  # un solo generador (PCG64) para todo el dataset demo
 
-    # Usuarios
+    # Usuarios (columnas construidas como arreglos, una sola llamada a DataFrame)
     facultades = ["Ingeniería", "Derecho", "Negocios", "Arquitectura", "Comunicación", "Rectorado"]
-    roles = ["estudiante"] * 120 + ["organizador"] * 6 + ["admin"] * 2
-    usuarios = []
-    for i in range(128):
-        rol = roles[i]
-        fac = np.random.choice(facultades) if rol in ["estudiante", "organizador"] else None
-        usuarios.append({
-            "id": f"u-{i:03}",
-            "nombre_completo": f"Usuario {i:03}",
-            "correo_institucional": f"user{i:03}@uep.edu",
-            "rol": rol,
-            "facultad": fac,
-            "activo": True,
-            "creado_en": datetime.now() - timedelta(days=np.random.randint(1, 200)),
-        })
-    df_users = pd.DataFrame(usuarios)
+    roles = np.array(["estudiante"] * 120 + ["organizador"] * 6 + ["admin"] * 2)
+    n_users = len(roles)
+    fac_users = np.where(np.isin(roles, ["estudiante", "organizador"]), rng.choice(facultades, n_users), None)
+    df_users = pd.DataFrame({
+        "id": [f"u-{i:03}" for i in range(n_users)],
+        "nombre_completo": [f"Usuario {i:03}" for i in range(n_users)],
+        "correo_institucional": [f"user{i:03}@uep.edu" for i in range(n_users)],
+        "rol": roles,
+        "facultad": fac_users,
+        "activo": True,
+        "creado_en": datetime.now() - pd.to_timedelta(rng.integers(1, 200, n_users), unit="D"),
+    })
 
     # Eventos (últimos 30 días)
     tipos = ["charla", "taller", "seminario", "conferencia"]
-    eventos = []
-    base_date = (datetime.now().date() - timedelta(days=30))
-    for i in range(18):
-        f = np.random.choice(facultades)
-        d = base_date + timedelta(days=np.random.randint(0, 30))
-        start = datetime.combine(d, datetime.min.time()) + timedelta(hours=int(np.random.choice([9, 11, 15, 18])))
-        end = start + timedelta(hours=2)
-        eventos.append({
-            "id": f"e-{i:03}",
-            "titulo": f"Evento {i:02} — {f}",
-            "tipo": np.random.choice(tipos),
-            "facultad": f,
-            "fecha": d,
-            "hora_inicio": start.time().strftime("%H:%M:%S"),
-            "hora_fin": end.time().strftime("%H:%M:%S"),
-            "organizador_id": np.random.choice(df_users.loc[df_users["rol"] == "organizador", "id"]),
-            "ubicacion": np.random.choice(["Auditorio A", "Auditorio B", "Sala 301", "Aula Magna"]),
-            "cupos": np.random.randint(40, 120),
-            "created_at": start - timedelta(days=3),
-        })
-    df_events = pd.DataFrame(eventos)
-
-    # Asistencias (aware UTC)
-    asistencias = []
-    for _, ev in df_events.iterrows():
-        candidates = df_users[df_users["rol"] == "estudiante"].sample(np.random.randint(30, 90))
-        # inicio en Lima → UTC
-        start_dt_utc = combine_date_time(pd.Series([ev["fecha"]]), pd.Series([ev["hora_inicio"]]))[0]
-        for _, stu in candidates.iterrows():
-            p = 0.75 if stu["facultad"] == ev["facultad"] else 0.6
-            if np.random.rand() < p:
-                offset_min = np.random.normal(loc=5, scale=12)  # minutos desde inicio
-                check_in_utc = start_dt_utc + timedelta(minutes=max(-10, int(offset_min)))
-                asistencias.append({
-                    "id": len(asistencias) + 1,
-                    "evento_id": ev["id"],
-                    "usuario_id": stu["id"],
-                    "hora_checkin": check_in_utc,  # aware UTC
-                    "metodo": np.random.choice(["QR", "manual", "NFC"], p=[0.8, 0.15, 0.05]),
-                    "estado": np.random.choice(["presente", "tarde", "no_show"], p=[0.7, 0.2, 0.1]),
-                    "valido": True,
-                    "created_at": check_in_utc,
-                    "origen": "demo",
-                })
-    df_att = pd.DataFrame(asistencias)
-    return df_users, df_events, df_att
-
-def get_data():
-    """Obtén datos desde Supabase o datos demo si no hay conexión."""
-    df_users, df_events, df_att = fetch_from_supabase()
-    if (
-        df_users is None or df_events is None or df_att is None
-        or df_users.empty or df_events.empty or df_att.empty
-    ):
+    n_events = 18
+    base_date = pd.Timestamp(datetime.now().date() - timedelta(days=30))
+    fac_events = rng.choice(facultades, n_events)
+    fechas = base_date + pd.to_timedelta(rng.integers(0, 30, n_events), unit="D")
+    start = fechas + pd.to_timedelta(rng.choice([9, 11, 15, 18], n_events), unit="h")
+    end = start + pd.Timedelta(hours=2)
+    organizadores = df_users.loc[df_users["rol"] == "organizador", "id"].to_numpy()
+    df_events = pd.DataFrame({
+        "id": [f"e-{i:03}" for i in range(n_events)],
+        "titulo": [f"Evento {i:02} — {f}" for i, f in enumerate(fac_events)],
+        "tipo": rng.choice(tipos, n_events),
+        "facultad": fac_events,
+        "fecha": fechas,
+        "hora_inicio": start.strftime("%H:%M:%S"),
+        "hora_fin": end.strftime("%H:%M:%S"),
+        "organizador_id": rng.choice(organizadores, n_events),
+        "ubicacion": rng.choice(["Auditorio A", "Auditorio B", "Sala 301", "Aula Magna"], n_events),
+        "cupos": rng.integers(40, 120, n_events),
+        "created_at": start - pd.Timedelta(days=3),
+    })
+
+    # Asistencias (aware UTC) — construcción vectorizada, sin iterrows
+    students = df_users[df_users["rol"] == "estudiante"]
+    stu_ids = students["id"].to_numpy()
+    stu_fac = students["facultad"].to_numpy()
+    ev_ids, ev_fechas, ev_horas, ev_fac = df_events[["id", "fecha", "hora_inicio", "facultad"]].to_numpy().T
+    n_events, n_students = len(ev_ids), len(stu_ids)
+
+    # inicio en Lima → UTC, una sola conversión para todos los eventos
+    start_dt_utc = pd.DatetimeIndex(combine_date_time(pd.Series(ev_fechas), pd.Series(ev_horas)))
+
+    # Muestreo sin reemplazo por evento: se ordenan claves aleatorias por fila
+    # y se toman los primeros `sizes[i]` estudiantes de cada una.
+    sizes = rng.integers(30, 90, n_events)
+    order = rng.random((n_events, n_students)).argsort(axis=1)
+    event_idx = np.repeat(np.arange(n_events), sizes)
+    student_idx = order[np.arange(n_students) < sizes[:, None]]
+
+    # Probabilidad de asistir: mayor si el estudiante es de la misma facultad
+    p = np.where(stu_fac[student_idx] == ev_fac[event_idx], 0.75, 0.6)
+    keep = rng.random(event_idx.size) < p
+    event_idx, student_idx = event_idx[keep], student_idx[keep]
+    n_att = event_idx.size
+
+    offset_min = np.maximum(-10, rng.normal(loc=5, scale=12, size=n_att).astype(int))  # minutos desde inicio
+    check_in_utc = start_dt_utc[event_idx] + pd.to_timedelta(offset_min, unit="min")
+    df_att = pd.DataFrame({
+        "id": np.arange(1, n_att + 1),
+        "evento_id": ev_ids[event_idx],
+        "usuario_id": stu_ids[student_idx],
+        "hora_checkin": check_in_utc,  # aware UTC
+        "metodo": rng.choice(["QR", "manual", "NFC"], size=n_att, p=[0.8, 0.15, 0.05]),
+        "estado": rng.choice(["presente", "tarde", "no_show"], size=n_att, p=[0.7, 0.2, 0.1]),
+        "valido": True,
+        "created_at": check_in_utc,
+        "origen": "demo",
+    })
+    df_att = enrich_attendance(df_events, df_att)
+    return to_category_dtypes(df_users, df_events, df_att)
+
+def filter_event_data(df_events, df_att, fac_sel=None, tipo_sel=None, d1=None, d2=None):
+    """
+    Aplica en pandas los mismos filtros que fetch_from_supabase resuelve en el servidor.
+    evento_id es category, así que el isin del semi-join compara códigos enteros.
+    """
+    if df_events.empty:
+        return df_events.copy(), df_att.copy()
+    mask_e = pd.Series(True, index=df_events.index)
+    if fac_sel is not None:
+        mask_e &= df_events["facultad"].isin(fac_sel)
+    if tipo_sel is not None:
+        mask_e &= df_events["tipo"].isin(tipo_sel)
+    if d1 is not None:
+        mask_e &= df_events["fecha"] >= pd.Timestamp(d1)
+    if d2 is not None:
+        mask_e &= df_events["fecha"] <= pd.Timestamp(d2)
+    df_events_f = df_events[mask_e].copy()
+    df_att_f = df_att[df_att["evento_id"].isin(df_events_f["id"])].copy()
+    return df_events_f, df_att_f
+
+def get_event_options():
+    """Eventos (al menos facultad, tipo y fecha) para poblar los filtros."""
+    df_opts = fetch_event_options_from_supabase() if supabase_has_data() else None
+    if df_opts is None or df_opts.empty:
+        return generate_demo_data()[1]
+    return df_opts
+
+def get_data(fac_sel=None, tipo_sel=None, d1=None, d2=None, with_att=True):
+    """
+    Obtén datos desde Supabase o datos demo si no hay conexión o las tablas están vacías
+    (supabase_has_data, la misma decisión que usan los filtros). Con filtros, un resultado
+    vacío de eventos/asistencias es válido y no activa el modo demo.
+    Retorna (usuarios, eventos, asistencias, es_demo).
+    """
+    filters = (
+        tuple(fac_sel) if fac_sel is not None else None,
+        tuple(tipo_sel) if tipo_sel is not None else None,
+        d1, d2,
+    )
+    filtered = any(v is not None for v in filters)
+    df_users = df_events = df_att = None
+    if supabase_has_data():
+        df_users, df_events, df_att = fetch_from_supabase(*filters, with_att=with_att)
+    if df_users is None or df_events is None or df_att is None:
         st.info("Usando datos de demostración (no se detectó conexión/tabla en Supabase).")
-        return generate_demo_data()
-    return df_users, df_events, df_att
+        df_users, df_events, df_att = generate_demo_data()
+        if filtered:
+            df_events, df_att = filter_event_data(df_events, df_att, *filters)
+        return df_users, df_events, df_att, True
+    return df_users, df_events, df_att, False
+
+def summarize_attendance(df_events_f, df_att_f):
+    """
+    Mismos agregados que resumen_asistencia, calculados en pandas sobre las
+    asistencias ya filtradas (modo demo o función no desplegada).
+    """
+    summary = {
+        "asistentes_unicos": 0,
+        "tendencia": pd.DataFrame(columns=["fecha", "asistentes"]),
+        "por_evento": pd.DataFrame(columns=["evento_id", "presentes"]),
+        "por_facultad_estado": pd.DataFrame(columns=["facultad", "estado", "n"]),
+        "heatmap": pd.DataFrame(columns=["facultad", "hora", "n"]),
+    }
+    if df_att_f.empty or df_events_f.empty:
+        return summary
+
+    checkin_utc = df_att_f["hora_checkin"].dt.tz_convert("UTC")
+    summary["asistentes_unicos"] = df_att_f["usuario_id"].nunique()
+    summary["tendencia"] = (
+        df_att_f.groupby(checkin_utc.dt.date.rename("fecha"), observed=True)["usuario_id"].nunique().reset_index(name="asistentes")
+    )
+    summary["por_evento"] = (
+        df_att_f.groupby("evento_id", observed=True, sort=False)["usuario_id"].nunique().reset_index(name="presentes")
+    )
+    summary["por_facultad_estado"] = (
+        df_att_f.groupby(["facultad_evento", "estado_ingreso"], observed=True)["usuario_id"]
+        .nunique()
+        .reset_index(name="n")
+        .rename(columns={"facultad_evento": "facultad", "estado_ingreso": "estado"})
+    )
+    summary["heatmap"] = (
+        df_att_f.groupby([df_att_f["facultad_evento"].rename("facultad"), checkin_utc.dt.hour.rename("hora")], observed=True)
+        ["usuario_id"].nunique().reset_index(name="n")
+    )
+    return summary
+
+def attendance_fingerprint(df_events_f, df_att_f):
+    """
+    Clave barata para la caché de agregados: ids de eventos, nº de asistencias, último
+    check-in y un hash del contenido que alimenta los agregados (cambia si se edita la
+    hora de inicio o la facultad de un evento, o una asistencia sin variar el conteo).
+    """
+    event_ids = tuple(sorted(df_events_f["id"].astype(str))) if not df_events_f.empty else ()
+    if df_att_f.empty:
+        return event_ids, 0, None, 0
+    cols = [c for c in ("evento_id", "usuario_id", "hora_checkin", "facultad_evento", "estado_ingreso") if c in df_att_f.columns]
+    content_hash = int(pd.util.hash_pandas_object(df_att_f[cols], index=False).sum())
+    return event_ids, len(df_att_f), df_att_f["hora_checkin"].max(), content_hash
+
+@st.cache_data(show_spinner=False, ttl=60, max_entries=64)
+def summarize_attendance_cached(fingerprint, _df_events_f, _df_att_f):
+    """
+    summarize_attendance memoizado por la huella de attendance_fingerprint. Los
+    dataframes (prefijo _) no se hashean: cada rerun solo calcula la huella.
+    """
+    return summarize_attendance(_df_events_f, _df_att_f)
 
 # ============ UI UTILITIES ============ #
 def login_page():
@@ -182,7 +509,9 @@ def login_page():
     password = st.text_input("Contraseña", type="password")
 
     if st.button("Iniciar sesión"):
-        if user in USERS and USERS[user] == password:
+        digest = hashlib.sha256(password.encode()).digest()
+        # compare_digest: tiempo constante, sin filtrar cuántos caracteres coinciden
+        if user in USERS and hmac.compare_digest(USERS[user], digest):
             st.session_state.logged_in = True
             st.session_state.role = user
             st.success("Inicio de sesión exitoso")
@@ -190,17 +519,50 @@ def login_page():
         else:
             st.error("Credenciales incorrectas. Intente nuevamente.")
 
-def kpis_header(df_events, df_att):
+@st.cache_data(show_spinner=False, ttl=60, max_entries=8)
+def users_by_id(df_users: pd.DataFrame) -> pd.DataFrame:
+    """Nombre y facultad de usuarios indexados por id, listos para DataFrame.join."""
+    return df_users.set_index("id")[["nombre_completo", "facultad"]]
+
+@st.cache_data(show_spinner=False, ttl=60, max_entries=32)
+def to_feather_bytes(df: pd.DataFrame) -> bytes:
+    """Serializa a Arrow IPC (feather); la caché evita repetirlo si el dataframe no cambió."""
+    buf = io.BytesIO()
+    df.reset_index(drop=True).to_feather(buf)
+    return buf.getvalue()
+
+@st.cache_data(show_spinner=False, ttl=60, max_entries=32)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """Serializa a CSV UTF-8; solo se invoca si el usuario elige ese formato."""
+    return df.to_csv(index=False).encode("utf-8")
+
+def download_table(df, label, file_stem, key):
+    """Botón de descarga en Arrow (feather) por defecto; CSV solo si se elige explícitamente."""
+    fmt = st.radio("Formato", ["Arrow (.feather)", "CSV"], horizontal=True, key=key)
+    if fmt == "CSV":
+        st.download_button(f"{label} CSV", data=to_csv_bytes(df), file_name=f"{file_stem}.csv", mime="text/csv")
+    else:
+        st.download_button(
+            f"{label} Arrow", data=to_feather_bytes(df), file_name=f"{file_stem}.feather",
+            mime="application/vnd.apache.arrow.file"
+        )
+
+def compute_kpis(df_events, summary):
+    """KPIs de la vista académica: (eventos, asistentes únicos, % cumplimiento, % no-show)."""
     n_eventos = df_events["id"].nunique() if not df_events.empty else 0
-    asistentes_unicos = df_att["usuario_id"].nunique() if not df_att.empty else 0
+    asistentes_unicos = summary["asistentes_unicos"]
 
-    if not df_events.empty and not df_att.empty:
+    if not df_events.empty and not summary["por_evento"].empty:
         total_cupos = df_events["cupos"].sum()
-        presentes = df_att.groupby("evento_id")["usuario_id"].nunique().sum()
+        presentes = summary["por_evento"]["presentes"].sum()
         cumplimiento = 100 * (presentes / total_cupos) if total_cupos > 0 else 0
     else:
         cumplimiento = 0.0
     no_show = max(0.0, 100 - cumplimiento * 0.8) if cumplimiento > 0 else 0.0
+    return n_eventos, asistentes_unicos, cumplimiento, no_show
+
+def kpis_header(df_events, summary):
+    n_eventos, asistentes_unicos, cumplimiento, no_show = compute_kpis(df_events, summary)
 
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("Eventos", n_eventos)
@@ -213,68 +575,63 @@ def vista_academica():
     st.title("📊 Vista Académica - Decanatos / Coordinación")
     st.caption("Análisis por facultad, tipo de evento y periodo")
 
-    df_users, df_events, df_att = get_data()
-    df_events = normalize_event_times(df_events)
+    df_opts = get_event_options()
 
     # Filtros
     colf1, colf2, colf3 = st.columns(3)
-    facultades = sorted([f for f in df_events["facultad"].dropna().unique()]) if not df_events.empty else []
-    tipos = sorted([t for t in df_events["tipo"].dropna().unique()]) if not df_events.empty else []
-    min_date = df_events["fecha"].min() if not df_events.empty else datetime.now().date()
-    max_date = df_events["fecha"].max() if not df_events.empty else datetime.now().date()
+    facultades = sorted([f for f in df_opts["facultad"].dropna().unique()]) if not df_opts.empty else []
+    tipos = sorted([t for t in df_opts["tipo"].dropna().unique()]) if not df_opts.empty else []
+    min_date = df_opts["fecha"].min().date() if not df_opts.empty else datetime.now().date()
+    max_date = df_opts["fecha"].max().date() if not df_opts.empty else datetime.now().date()
 
     fac_sel = colf1.multiselect("Facultad", facultades, default=facultades)
     tipo_sel = colf2.multiselect("Tipo de evento", tipos, default=tipos)
     date_range = colf3.date_input("Rango de fechas", value=(min_date, max_date))
 
-    # Aplicar filtros
-    if not df_events.empty:
-        mask_e = (df_events["facultad"].isin(fac_sel)) & (df_events["tipo"].isin(tipo_sel))
-        if isinstance(date_range, tuple) and len(date_range) == 2:
-            d1, d2 = date_range
-            mask_e &= (df_events["fecha"] >= d1) & (df_events["fecha"] <= d2)
-        df_events_f = df_events[mask_e].copy()
-        df_att_f = df_att[df_att["evento_id"].isin(df_events_f["id"])].copy()
-    else:
-        df_events_f, df_att_f = df_events.copy(), df_att.copy()
+    # Aplicar filtros (en Supabase si hay conexión). Si la función resumen_asistencia
+    # está desplegada, los agregados llegan ya calculados y no se leen asistencias crudas.
+    d1, d2 = date_range if isinstance(date_range, tuple) and len(date_range) == 2 else (None, None)
+    summary = fetch_att_summary_from_supabase(tuple(fac_sel), tuple(tipo_sel), d1, d2)
+    df_users, df_events_f, df_att_f, es_demo = get_data(fac_sel, tipo_sel, d1, d2, with_att=summary is None)
+    df_events_f = normalize_event_times(df_events_f)
+    if es_demo:
+        summary = None  # los agregados de Supabase no corresponden a los eventos demo
+    if summary is None:
+        summary = summarize_attendance_cached(attendance_fingerprint(df_events_f, df_att_f), df_events_f, df_att_f)
 
     # KPIs
-    kpis_header(df_events_f, df_att_f)
+    kpis_header(df_events_f, summary)
 
     # -------- Gráfico 1: Serie temporal global -------- #
     st.subheader("Tendencia diaria de asistencia")
-    if not df_att_f.empty:
-        df_tmp = df_att_f.copy()
-        df_tmp["fecha"] = df_tmp["hora_checkin"].dt.tz_convert("UTC").dt.date
-        trend = df_tmp.groupby("fecha")["usuario_id"].nunique().reset_index(name="asistentes")
-        st.line_chart(trend.set_index("fecha"))
+    trend = summary["tendencia"]
+    if not trend.empty:
+        chart = (
+            alt.Chart(trend)
+            .mark_line(point=True)
+            .encode(
+                x=alt.X("fecha:T", title="Fecha"),
+                y=alt.Y("asistentes:Q", title="Asistentes únicos"),
+                tooltip=["fecha:T", "asistentes"]
+            )
+            .properties(height=300)
+        )
+        st.altair_chart(chart, width="stretch")
     else:
         st.info("Sin datos para la tendencia.")
 
     # -------- Gráfico 2: Barras apiladas por facultad (Presente / Tarde / No-show) -------- #
     st.subheader("Comparativo por facultad")
-    if not df_att_f.empty and not df_events_f.empty:
-        ev_cols = ["id", "fecha", "hora_inicio", "facultad", "cupos"]
-        ev_meta = df_events_f[ev_cols].copy()
-        ev_meta["inicio_dt"] = combine_date_time(ev_meta["fecha"], ev_meta["hora_inicio"], local_tz="America/Lima")
-        ev_meta = ev_meta.dropna(subset=["inicio_dt"])
-
-        m = df_att_f.merge(
-            ev_meta[["id", "inicio_dt", "facultad", "cupos"]],
-            left_on="evento_id", right_on="id", how="left", suffixes=("", "_e")
-        ).dropna(subset=["inicio_dt"])
-
-        m["lat_min"] = (m["hora_checkin"] - m["inicio_dt"]).dt.total_seconds() / 60
-        m["estado"] = np.where(m["lat_min"] <= 15, "Presente", "Tarde")
-
-        pres_por_evento = m.groupby("evento_id")["usuario_id"].nunique()
-        ev_fac = ev_meta.set_index("id")[["facultad", "cupos"]].copy()
-        ev_fac["presentes"] = pres_por_evento
-        ev_fac["presentes"] = ev_fac["presentes"].fillna(0)
+    por_fac_estado = summary["por_facultad_estado"]
+    if not por_fac_estado.empty and not df_events_f.empty:
+        by_fac_estado = por_fac_estado.set_index(["facultad", "estado"])["n"].unstack(fill_value=0)
+        by_fac_estado.columns = by_fac_estado.columns.astype(str)
+
+        ev_fac = df_events_f.set_index("id")[["facultad", "cupos"]].copy()
+        pres_por_evento = summary["por_evento"].set_index("evento_id")["presentes"]
+        ev_fac["presentes"] = pres_por_evento.reindex(ev_fac.index).fillna(0)
         ev_fac["no_show"] = (ev_fac["cupos"] * 0.8 - ev_fac["presentes"]).clip(lower=0)
-
-        by_fac_estado = m.groupby(["facultad", "estado"])["usuario_id"].nunique().unstack(fill_value=0)
-        no_show_fac = ev_fac.groupby("facultad")["no_show"].sum()
+        no_show_fac = ev_fac.groupby("facultad", observed=True, sort=False)["no_show"].sum()
         by_fac_estado["No-show"] = no_show_fac.reindex(by_fac_estado.index).fillna(0)
 
         st.bar_chart(by_fac_estado)
@@ -283,35 +640,43 @@ def vista_academica():
 
     # -------- Gráfico 3: Heatmap día-hora -------- #
     st.subheader("Mapa de calor por hora y facultad")
-    if not df_att_f.empty:
-        tmp = df_att_f.copy()
-        tmp["hora"] = tmp["hora_checkin"].dt.tz_convert("UTC").dt.hour
-        tmp = tmp.merge(df_events_f[["id", "facultad"]], left_on="evento_id", right_on="id", how="left")
-        heat = tmp.pivot_table(index="facultad", columns="hora", values="usuario_id", aggfunc="nunique").fillna(0)
-        st.dataframe(heat.style.background_gradient(axis=None))
+    if not summary["heatmap"].empty:
+        heat = (
+            alt.Chart(summary["heatmap"])
+            .mark_rect()
+            .encode(
+                x=alt.X("hora:O", title="Hora (UTC)"),
+                y=alt.Y("facultad:N", title="Facultad"),
+                color=alt.Color("n:Q", title="Asistentes"),
+                tooltip=["facultad", "hora", "n"]
+            )
+        )
+        st.altair_chart(heat, width="stretch")
     else:
         st.info("Sin datos para el heatmap.")
 
     # Tabla descargable
     st.subheader("Detalle de eventos filtrados")
-    st.dataframe(df_events_f)
-    csv_bytes = df_events_f.to_csv(index=False).encode("utf-8")
-    st.download_button("Descargar eventos CSV", data=csv_bytes, file_name="eventos_filtrados.csv", mime="text/csv")
+    st.dataframe(df_events_f, column_config={"fecha": st.column_config.DateColumn("fecha")})
+    download_table(df_events_f, "Descargar eventos", "eventos_filtrados", key="dl_eventos")
 
 def vista_organizador():
     st.title("📋 Vista del Organizador - Gestión de Eventos")
     st.caption("Monitoreo de check-ins, tardanzas y asistencia por evento")
 
-    df_users, df_events, df_att = get_data()
+    df_users, df_events, df_att, _ = get_data()
     df_events = normalize_event_times(df_events)
 
     if df_events.empty:
         st.info("No hay eventos disponibles.")
         return
 
-    # Selector "Título | ID"
-    evento_sel = st.selectbox("Selecciona tu evento", df_events["titulo"] + " | " + df_events["id"])
-    ev_id = evento_sel.split("|")[-1].strip()
+    # Selector "Título | ID": las opciones son los ids, el texto lo arma format_func
+    title_map = dict(zip(df_events["id"], df_events["titulo"]))
+    ev_id = st.selectbox(
+        "Selecciona tu evento", options=list(title_map),
+        format_func=lambda eid: f"{title_map[eid]} | {eid}"
+    )
 
     df_ev = df_events[df_events["id"] == ev_id]
     df_ev_att = df_att[df_att["evento_id"] == ev_id].copy()
@@ -326,12 +691,7 @@ def vista_organizador():
     col2.metric("Cupos", int(df_ev["cupos"].values[0]) if "cupos" in df_ev.columns else 0)
 
     if not df_ev_att.empty:
-        # Inicio del evento (aware UTC)
-        start_dt_series = combine_date_time(pd.Series([df_ev["fecha"].values[0]]),
-                                            pd.Series([df_ev["hora_inicio"].values[0]]))
-        start_dt = start_dt_series.iloc[0]
-
-        df_ev_att["lat_min"] = (df_ev_att["hora_checkin"] - start_dt).dt.total_seconds() / 60
+        # lat_min viene precalculada desde la carga (enrich_attendance)
         tardanza_media = df_ev_att["lat_min"].clip(lower=0).mean()
         col3.metric("Tardanza media (min)", f"{tardanza_media:.1f}")
         tasa_exito = (df_ev_att["metodo"].astype(str).str.upper() == "QR").mean() * 100
@@ -340,23 +700,35 @@ def vista_organizador():
         # Check-ins por minuto
         st.subheader("Flujo de check-ins por minuto")
         df_ev_att["minuto"] = df_ev_att["hora_checkin"].dt.floor("min")  # 'T' deprecated
-        dens = df_ev_att.groupby("minuto")["usuario_id"].nunique().reset_index(name="checkins")
-        st.area_chart(dens.set_index("minuto"))
+        dens = df_ev_att.groupby("minuto", observed=True)["usuario_id"].nunique().reset_index(name="checkins")
+        chart = (
+            alt.Chart(dens)
+            .mark_area()
+            .encode(
+                x=alt.X("minuto:T", title="Minuto"),
+                y=alt.Y("checkins:Q", title="Check-ins"),
+                tooltip=["minuto:T", "checkins"]
+            )
+            .properties(height=300)
+        )
+        st.altair_chart(chart, width="stretch")
 
         # Histograma de latencia
         st.subheader("Distribución de latencia de ingreso")
         bins = [-10, 0, 5, 10, 15, 20, 30, 60]
-        cats = pd.cut(df_ev_att["lat_min"], bins=bins, include_lowest=True)
-        hist = cats.value_counts().sort_index()
+        # Etiquetas fijas: el conteo se hace sobre códigos de categoría, no sobre objetos Interval
+        labels = [f"({a}, {b}]" for a, b in zip(bins[:-1], bins[1:])]
+        labels[0] = "[" + labels[0][1:]  # include_lowest
+        cats = pd.cut(df_ev_att["lat_min"], bins=bins, labels=labels, include_lowest=True)
+        hist = cats.value_counts(sort=False).reindex(labels, fill_value=0)
 
         df_hist = hist.rename_axis("bin").reset_index(name="count")
-        df_hist["bin"] = df_hist["bin"].astype(str)
 
         chart = (
             alt.Chart(df_hist)
             .mark_bar()
             .encode(
-                x=alt.X("bin:N", title="Minutos desde inicio"),
+                x=alt.X("bin:N", title="Minutos desde inicio", sort=labels),
                 y=alt.Y("count:Q", title="Asistentes"),
                 tooltip=["bin", "count"]
             )
@@ -366,16 +738,12 @@ def vista_organizador():
 
         # Detalle por alumno
         st.subheader("Detalle por alumno")
-        detalle = df_ev_att.merge(
-            df_users[["id", "nombre_completo", "facultad"]],
-            left_on="usuario_id",
-            right_on="id",
-            how="left"
-        )[["usuario_id", "nombre_completo", "facultad", "hora_checkin", "metodo", "lat_min"]].sort_values("hora_checkin")
+        detalle = df_ev_att.join(users_by_id(df_users), on="usuario_id")[
+            ["usuario_id", "nombre_completo", "facultad", "hora_checkin", "metodo", "lat_min"]
+        ].sort_values("hora_checkin")
         st.dataframe(detalle)
 
-        csv_det = detalle.to_csv(index=False).encode("utf-8")
-        st.download_button("Descargar detalle CSV", data=csv_det, file_name=f"detalle_{ev_id}.csv", mime="text/csv")
+        download_table(detalle, "Descargar detalle", f"detalle_{ev_id}", key="dl_detalle")
     else:
         st.info("Este evento aún no tiene asistencias registradas.")
 
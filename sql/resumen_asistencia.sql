@@ -0,0 +1,76 @@
+-- Agregados de asistencia para la vista académica.
+-- Se expone vía PostgREST y el dashboard la invoca con supabase.rpc("resumen_asistencia", {...}).
+-- Los parámetros NULL desactivan el filtro correspondiente.
+create or replace function resumen_asistencia(
+    p_facultades text[] default null,
+    p_tipos text[] default null,
+    p_desde date default null,
+    p_hasta date default null
+) returns json
+language sql
+stable
+as $$
+    with ev as (
+        select id,
+               facultad,
+               -- la hora declarada es local (America/Lima)
+               (fecha + hora_inicio) at time zone 'America/Lima' as inicio_dt
+        from eventos
+        where (p_facultades is null or facultad = any(p_facultades))
+          and (p_tipos is null or tipo = any(p_tipos))
+          and (p_desde is null or fecha >= p_desde)
+          and (p_hasta is null or fecha <= p_hasta)
+    ),
+    att as (
+        select a.evento_id, a.usuario_id, a.hora_checkin, ev.facultad, ev.inicio_dt
+        from asistencias a
+        join ev on ev.id = a.evento_id
+    )
+    select json_build_object(
+        'asistentes_unicos', (select count(distinct usuario_id) from att),
+        'tendencia', (
+            select coalesce(json_agg(t order by t.fecha), '[]'::json)
+            from (
+                select (hora_checkin at time zone 'UTC')::date as fecha,
+                       count(distinct usuario_id) as asistentes
+                from att
+                where hora_checkin is not null
+                group by 1
+            ) t
+        ),
+        'por_evento', (
+            select coalesce(json_agg(t), '[]'::json)
+            from (
+                select evento_id, count(distinct usuario_id) as presentes
+                from att
+                group by 1
+            ) t
+        ),
+        'por_facultad_estado', (
+            select coalesce(json_agg(t), '[]'::json)
+            from (
+                select facultad,
+                       case when extract(epoch from hora_checkin - inicio_dt) / 60 <= 15
+                            then 'Presente' else 'Tarde' end as estado,
+                       count(distinct usuario_id) as n
+                from att
+                -- mismos descartes que pandas: sin facultad o sin latencia no hay grupo
+                where facultad is not null and inicio_dt is not null and hora_checkin is not null
+                group by 1, 2
+            ) t
+        ),
+        'heatmap', (
+            select coalesce(json_agg(t), '[]'::json)
+            from (
+                select facultad,
+                       extract(hour from hora_checkin at time zone 'UTC')::int as hora,
+                       count(distinct usuario_id) as n
+                from att
+                where facultad is not null and hora_checkin is not null
+                group by 1, 2
+            ) t
+        )
+    );
+$$;
+
+grant execute on function resumen_asistencia(text[], text[], date, date) to anon, authenticated;